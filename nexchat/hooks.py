@@ -133,6 +133,12 @@ app_include_js = "/assets/nexchat/js/nexchat.js"
 # 	"ToDo": "custom_app.overrides.CustomToDo"
 # }
 
+# Cache Clearing
+# --------------
+# Called on a full frappe.clear_cache (bench clear-cache, migrate)
+
+clear_cache = "nexchat.api.clear_meta_cache"
+
 # Document Events
 # ---------------
 # Hook on document methods and events
@@ -145,6 +151,54 @@ app_include_js = "/assets/nexchat/js/nexchat.js"
 # 	}
 # }
 
+doc_events = {
+	"DocType": {
+		"on_update": "nexchat.api.clear_meta_cache",
+		"on_trash": "nexchat.api.clear_meta_cache"
+	},
+	"Custom Field": {
+		"on_update": "nexchat.api.clear_meta_cache",
+		"on_trash": "nexchat.api.clear_meta_cache"
+	},
+	"Property Setter": {
+		"on_update": "nexchat.api.clear_meta_cache",
+		"on_trash": "nexchat.api.clear_meta_cache"
+	},
+	"Custom DocPerm": {
+		"on_update": "nexchat.api.clear_meta_cache",
+		"on_trash": "nexchat.api.clear_meta_cache"
+	},
+	"Warehouse": {
+		"after_insert": "nexchat.api.clear_warehouse_cache",
+		"on_update": "nexchat.api.clear_warehouse_cache",
+		"after_rename": "nexchat.api.clear_warehouse_cache",
+		"on_trash": "nexchat.api.clear_warehouse_cache"
+	},
+	"Role": {
+		"after_insert": "nexchat.api.clear_roles_cache",
+		"on_update": "nexchat.api.clear_roles_cache",
+		"after_rename": "nexchat.api.clear_roles_cache",
+		"on_trash": "nexchat.api.clear_roles_cache"
+	},
+	"Company": {
+		"after_insert": "nexchat.api.clear_company_cache",
+		"after_rename": "nexchat.api.clear_company_cache",
+		"on_trash": "nexchat.api.clear_company_cache"
+	},
+	"Asset Category": {
+		"after_insert": "nexchat.api.clear_asset_field_cache",
+		"on_update": "nexchat.api.clear_asset_field_cache",
+		"after_rename": "nexchat.api.clear_asset_field_cache",
+		"on_trash": "nexchat.api.clear_asset_field_cache"
+	},
+	"Employee": {
+		"after_insert": "nexchat.api.clear_asset_field_cache",
+		"on_update": "nexchat.api.clear_asset_field_cache",
+		"after_rename": "nexchat.api.clear_asset_field_cache",
+		"on_trash": "nexchat.api.clear_asset_field_cache"
+	}
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Comprehensive fix for indentation errors in api.py
+import re
+
+# The try/except block around line 1800-1803: try is followed by an except
+# with wrong indentation
+EARLY_DETECTION_EXCEPT = re.compile(r'(\s+try:\n\s+frappe\.log_error\([^)]+\), "Early Detection"\)\n)(\s+except:)')
+
+# 0-based line index -> (test for the broken line, replacement line)
+LINE_FIXES = {
+    # Fix line 1728: matching_options
+    1727: (lambda line: 'matching_options = [opt for opt in numbered_options' in line,
+           '                    matching_options = [opt for opt in numbered_options if user_input.lower() in opt.lower()]'),
+    # Fix line 2071: except over-indented
+    2070: (lambda line: '                    except:' in line, '            except:'),
+    # Fix line 2072: pass over-indented
+    2071: (lambda line: '                        pass' in line, '                pass'),
+    # Fix line 2082: else misaligned
+    2081: (lambda line: line.strip() == 'else:' and not line.startswith('            else:'), '            else:'),
+    # Fix line 2703: missing indent
+    2702: (lambda line: 'missing_fields.append(field)' in line and not line.startswith('                    '),
+           '                    missing_fields.append(field)'),
+    # Fix line 2753: missing indent
+    2752: (lambda line: 'field_to_ask = missing_fields[0]' in line and not line.startswith('            '),
+           '            field_to_ask = missing_fields[0]'),
+    # Fix line 2883: else misaligned
+    2882: (lambda line: line.strip() == 'else:' and '        else:' not in line, '                        else:'),
+    # Fix line 4940: missing indent
+    4939: (lambda line: 'selected_value = numbered_options[num - 1]' in line and not line.startswith('                    '),
+           '                    selected_value = numbered_options[num - 1]'),
+    # Fix line 4944: missing indent
+    4943: (lambda line: 'return f"❌ Invalid input. Please use numbers or direct input."' in line and not line.startswith('                '),
+           '                return f"❌ Invalid input. Please use numbers or direct input."'),
+    # Fix line 4972: else misaligned
+    4971: (lambda line: line.strip() == 'else:' and not line.startswith('            '), '            else:'),
+}
+
+def fix_line(i, line):
+    fix = LINE_FIXES.get(i)
+    if fix and fix[0](line):
+        return fix[1]
+    return line
+
+def fix_file():
+    with open('api.py', 'r') as f:
+        content = f.read()
+
+    content = EARLY_DETECTION_EXCEPT.sub(r'\1                    except:', content)
+
+    # Fix multiple other indentation issues; only the listed lines can change
+    lines = content.split('\n')
+    for i in sorted(LINE_FIXES):
+        if i < len(lines):
+            lines[i] = fix_line(i, lines[i])
+
+    with open('api.py', 'w') as f:
+        f.write('\n'.join(lines))
+
+    print("Applied comprehensive fixes")
+
+if __name__ == "__main__":
+    fix_file()
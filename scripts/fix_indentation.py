@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# Fix specific indentation errors in api.py, working on raw bytes
+import os
+import re
+import shutil
+import tempfile
+
+# except blocks and pass statements with too much indentation
+BAD_EXCEPT = re.compile(rb' {20}except:').match
+BAD_PASS = re.compile(rb' {24}pass\s*\Z').match
+
+# 0-based line index -> (test for the broken line, replacement line)
+LINE_FIXES = {
+    # Fix line 1728: matching_options should be indented properly
+    1727: (lambda line: b'matching_options = [opt for opt in numbered_options' in line,
+           b'                    matching_options = [opt for opt in numbered_options if user_input.lower() in opt.lower()]\n'),
+    # Fix line 2071: except should not be over-indented
+    2070: (lambda line: b'                    except:' in line, b'            except:\n'),
+    # Fix line 2072: pass should be properly indented
+    2071: (lambda line: b'                        pass' in line, b'                pass\n'),
+    # Fix line 2074: if should not be expected expression
+    2073: (lambda line: line.strip().startswith(b'if missing_child_tables:'), b'            if missing_child_tables:\n'),
+    # Fix line 2076: child_table_to_collect should be properly indented
+    2075: (lambda line: b'child_table_to_collect = missing_child_tables[0]' in line,
+           b'                child_table_to_collect = missing_child_tables[0]\n'),
+    # Fix line 2082: else should be properly aligned
+    2081: (lambda line: line.strip().startswith(b'else:'), b'            else:\n'),
+}
+
+def fix_line(i, line):
+    fix = LINE_FIXES.get(i)
+    if fix and fix[0](line):
+        return fix[1]
+    # Fix other similar issues that might exist:
+    # except blocks and pass statements with too much indentation
+    if BAD_EXCEPT(line):
+        return b'            except:\n'
+    if BAD_PASS(line):
+        return b'                pass\n'
+    return line
+
+def fix_indentation(path='api.py'):
+    # Stream into a temp file next to api.py, then swap it in atomically
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path, 'rb') as infile, tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as outfile:
+        for i, line in enumerate(infile):
+            outfile.write(fix_line(i, line))
+    shutil.copymode(path, outfile.name)
+    os.replace(outfile.name, path)
+
+    print("Fixed indentation errors")
+
+if __name__ == "__main__":
+    fix_indentation()